@@ -0,0 +1,224 @@
+"""
+Pure-Python core of the puzzle classification loop: PGN slicing, header
+and first-move extraction, FEN normalization, and batched output writing.
+
+Kept free of numpy and the engine/NN modules on purpose - it depends only
+on chess, re and io, so the orchestration-heavy inner loop can run
+unmodified (and much faster) under PyPy, or be AOT-compiled with Cython,
+while classify_puzzles.py handles the engine/NN side.
+"""
+
+import io
+import logging
+import os
+import re
+
+import chess
+import chess.pgn
+
+logger = logging.getLogger(__name__)
+
+# How many puzzles go into each output batch file (overridable via
+# --batch-size). The old default of 25 made for tiny files whose
+# open/close churn defeated OS write-behind; 1000 keeps files manageable
+# while amortizing rotation cost.
+PUZZLES_PER_BATCH = 1000
+# Separator written between puzzles; a module-level constant so the hot
+# path never builds a concatenated "pgn + separator" string.
+PGN_SEPARATOR = b"\n\n"
+# Rough per-puzzle size used to preallocate each batch file up front,
+# avoiding extent-allocation churn as the file grows write by write.
+AVG_PUZZLE_BYTES = 600
+
+class BatchPgnWriter:
+    """
+    Writes classified puzzles into numbered batch files named
+    <base_name>_batch_N.pgn, rotating every puzzles_per_batch puzzles.
+    Each new file is preallocated to its estimated final size
+    (posix_fallocate, where available) and each puzzle goes out as a
+    single writev of [pgn bytes, separator] - one syscall, no
+    concatenated intermediate string. On close the file is truncated
+    back to the bytes actually written.
+
+    Batches are written under a .tmp name and atomically renamed into
+    place (after fsync) when complete, so a consumer watching the output
+    directory only ever sees finished batch files.
+    """
+
+    def __init__(self, base_name, puzzles_per_batch=PUZZLES_PER_BATCH):
+        self.base_name = base_name
+        self.puzzles_per_batch = puzzles_per_batch
+        self.batch_num = 0
+        self.puzzles_in_current_batch = 0
+        self.total_written = 0
+        self.bytes_written = 0
+        self.file = None
+        self.final_name = None
+
+    def write(self, pgn_bytes):
+        if self.file is None or self.puzzles_in_current_batch >= self.puzzles_per_batch:
+            self._rotate()
+        if self.file is None:
+            return  # Open failed; error already reported.
+        try:
+            expected = len(pgn_bytes) + len(PGN_SEPARATOR)
+            written = os.writev(self.file.fileno(), [pgn_bytes, PGN_SEPARATOR])
+            if written < expected:
+                # Short writev (rare on regular files); push out the rest.
+                remainder = (pgn_bytes + PGN_SEPARATOR)[written:]
+                while remainder:
+                    remainder = remainder[os.write(self.file.fileno(), remainder):]
+            self.bytes_written += expected
+            self.puzzles_in_current_batch += 1
+            self.total_written += 1
+        except OSError as e:
+            logger.error("Error writing to batch file %s: %s", self.file.name, e)
+
+    def _rotate(self):
+        self._close_current()
+        self.batch_num += 1
+        self.final_name = f"{self.base_name}_batch_{self.batch_num}.pgn"
+        tmp_name = self.final_name + ".tmp"
+        try:
+            # Unbuffered: write() issues exactly one writev per puzzle, so
+            # a Python-side buffer would only add a copy.
+            self.file = open(tmp_name, 'wb', buffering=0)
+            logger.info("Opened new batch file: %s", self.final_name)
+        except IOError as e:
+            logger.error("Error opening batch file %s: %s", tmp_name, e)
+            self.file = None # Prevent further writes if open failed
+            self.puzzles_in_current_batch = 0
+            self.bytes_written = 0
+            return
+        try:
+            os.posix_fallocate(self.file.fileno(), 0, self.puzzles_per_batch * AVG_PUZZLE_BYTES)
+        except (AttributeError, OSError):
+            pass  # Not supported on this platform/filesystem; harmless.
+        self.puzzles_in_current_batch = 0
+        self.bytes_written = 0
+
+    def _close_current(self):
+        if self.file:
+            tmp_name = self.file.name
+            try:
+                # Undo any preallocation beyond what was actually written.
+                os.ftruncate(self.file.fileno(), self.bytes_written)
+                os.fsync(self.file.fileno())
+            except OSError:
+                pass
+            self.file.close()
+            self.file = None
+            try:
+                os.rename(tmp_name, self.final_name)
+                logger.info("Closed batch file: %s", self.final_name)
+            except OSError as e:
+                logger.error("Error finalizing batch file %s: %s", self.final_name, e)
+
+    def close(self):
+        self._close_current()
+
+def normalize_fen(fen_str):
+    """
+    Cache key for a FEN: drops the halfmove/fullmove counters so
+    transposed duplicates still hit. Both evaluation paths are keyed the
+    same way - the UCI engine runs with CacheHistoryLength=0 and the
+    direct-NN encoder zeroes the rule-50 plane - so entries are valid
+    regardless of which counter values the FEN carried.
+    """
+    return " ".join(fen_str.split()[:4])
+
+# chess.pgn.read_game builds a full game tree with comments, NAGs and
+# variations; for puzzles we only need three header tags and the first
+# movetext token, which these patterns scan straight out of the source
+# bytes. The full parser stays as a fallback for slices they can't handle.
+HEADER_RE = re.compile(rb'^\[(\w+)\s+"([^"]*)"\]', re.M)
+# First SAN token after the blank line ending the header section,
+# skipping any leading move number ("1." / "1...").
+FIRST_MOVE_RE = re.compile(rb'\n\s*\n\s*(?:\d+\.{1,3}\s*)?([A-Za-z][\w\-+#=]*)')
+
+# A new game starts at '[Event' after a blank line; the optional \r's
+# make the scan work on CRLF dumps too. The lookahead keeps '[Event'
+# itself out of the match so the next slice starts exactly on it.
+GAME_BOUNDARY_RE = re.compile(rb'\r?\n\s*\r?\n\s*(?=\[Event)')
+
+def iter_game_slices(pgn_data):
+    """
+    Splits raw PGN bytes into one slice per game, with no re-serialization:
+    a new game starts at '[Event' following a blank line (or at the start
+    of the data). Handles both LF and CRLF line endings. Each yielded
+    slice is the game's exact source bytes with surrounding blank lines
+    trimmed, so it can be copied verbatim to an output file.
+    """
+    start = pgn_data.find(b"[Event")
+    while start != -1:
+        boundary = GAME_BOUNDARY_RE.search(pgn_data, start)
+        if boundary is None:
+            yield pgn_data[start:].strip()
+            return
+        yield pgn_data[start:boundary.start()].strip()
+        start = boundary.end()
+
+def iter_puzzles(pgn_data, stats):
+    """
+    Walks the raw PGN bytes and yields one
+    (puzzle_id_str, pgn_bytes, fen, solution_move, forced_move) tuple per
+    classifiable puzzle, without touching the engine; pgn_bytes is the
+    game's verbatim source slice, later copied straight to the output
+    batch file instead of being re-exported from the parsed game tree.
+    forced_move is the position's only legal move when there is exactly
+    one (Maia must return it, so no NN call is needed), else None.
+
+    stats is a dict updated in place: 'processed' counts every game seen,
+    'errors' the ones skipped. A generator so a consumer can start
+    classifying while the rest of the input is still being scanned.
+    """
+    for game_bytes in iter_game_slices(pgn_data):
+        stats['processed'] += 1
+        headers = {name.decode('utf-8'): value.decode('utf-8')
+                   for name, value in HEADER_RE.findall(game_bytes)}
+        current_puzzle_id_str = f"puzzle #{stats['processed']} (Event: {headers.get('Event', 'N/A')})"
+
+        fen = headers.get("FEN")
+        setup = headers.get("SetUp")
+
+        if setup == "1" and not fen:
+            logger.error("Error: %s has SetUp='1' but no FEN tag. Skipping.", current_puzzle_id_str)
+            stats['errors'] += 1
+            continue
+        if not fen:
+            logger.error("Error: %s FEN tag not found. Cannot determine position. Skipping.", current_puzzle_id_str)
+            stats['errors'] += 1
+            continue
+
+        # Only the first solution move matters for classification: grab its
+        # SAN token with the regex and parse just that one move.
+        solution_move = None
+        forced_move = None
+        first_move_match = FIRST_MOVE_RE.search(game_bytes)
+        if first_move_match:
+            try:
+                board = chess.Board(fen)
+                solution_move = board.parse_san(first_move_match.group(1).decode('utf-8'))
+                # If the position has exactly one legal move, Maia has no
+                # choice; the classifier can skip the NN call entirely.
+                if board.legal_moves.count() == 1:
+                    forced_move = solution_move
+            except ValueError:
+                solution_move = None
+
+        if solution_move is None:
+            # Regex scan came up empty or illegal; let the full parser have
+            # a go before declaring the puzzle broken.
+            game = chess.pgn.read_game(io.StringIO(game_bytes.decode('utf-8')))
+            first_node = game.next() if game is not None else None
+            if first_node is None or first_node.move is None:
+                logger.error("Error: %s no solution move found. Skipping.", current_puzzle_id_str)
+                logger.error("  Headers: %s", headers)
+                if game is not None and game.errors:
+                    logger.error("  Parser errors: %s", game.errors)
+                stats['errors'] += 1
+                continue
+            solution_move = first_node.move
+
+        yield (current_puzzle_id_str, game_bytes, fen, solution_move, forced_move)
+
@@ -1,10 +1,25 @@
+import argparse
+
 import chess
-import chess.pgn
 import chess.engine
-import io
-import sys # Import sys module
+import concurrent.futures
+import logging
+import mmap
+import queue
+import sqlite3
+import threading
 import os # Import os module
 
+import maia_net # Optional direct-NN fast path (ONNX), falls back to UCI
+from classify_core import (
+    PUZZLES_PER_BATCH,
+    BatchPgnWriter,
+    iter_puzzles,
+    normalize_fen,
+)
+
+logger = logging.getLogger(__name__)
+
 # IMPORTANT: User needs to configure these paths
 # Example for Linux/macOS if Maia is in the same directory:
 # MAIA_EXECUTABLE_PATH = "./maia"
@@ -15,6 +30,57 @@ LC0_EXECUTABLE_PATH = "/opt/homebrew/bin/lc0"  # <--- UPDATE THIS PATH
 # Example weights file (choose one, e.g., maia-1100.pb.gz, maia-1500.pb.gz)
 MAIA_WEIGHTS_PATH = "maia-1100.pb"  # <--- UPDATE THIS PATH
 
+# How many collected FENs are dispatched to the engine side per round on
+# the UCI path. Lc0's MinibatchSize/MaxPrefetch are set to match so the
+# backend can batch network evaluations instead of running one forward
+# pass per call. The direct-NN path uses maia_net.NN_BATCH_SIZE instead.
+BATCH_SIZE = 64
+# Bound on the pipeline queues between the reader, evaluation and writer
+# stages, so a fast stage can run ahead without buffering the whole corpus.
+QUEUE_DEPTH = 128
+# Lc0 backend to request, e.g. "blas", "eigen", "cuda-fp16". Leave as None
+# to let Lc0 pick its default.
+LC0_BACKEND = None
+# Backends where multiple Lc0 processes would just fight over one GPU.
+GPU_BACKENDS = ("cuda", "cuda-fp16", "cudnn", "cudnn-fp16", "metal", "onednn")
+
+def num_engine_workers():
+    """
+    Number of Lc0 processes to keep alive. Classification is embarrassingly
+    parallel across puzzles, so on CPU backends one engine per pair of cores
+    gives near-linear speedup. On GPU backends multiple processes serialize
+    on the device anyway, so keep a single engine and rely on MinibatchSize.
+    With LC0_BACKEND unset the backend is whatever Lc0 autodetects - a GPU
+    one on GPU builds - so the pool is only grown when a non-GPU backend
+    has been configured explicitly.
+    """
+    if LC0_BACKEND and not LC0_BACKEND.startswith(GPU_BACKENDS):
+        return max(1, (os.cpu_count() or 2) // 2)
+    return 1
+
+def start_maia_engine():
+    """
+    Spawns one Lc0 process configured for Maia next-move prediction
+    with batching-friendly options. Returns a SimpleEngine instance.
+    Raises the underlying exception on failure (caller handles/report).
+    """
+    engine = chess.engine.SimpleEngine.popen_uci(LC0_EXECUTABLE_PATH)
+    options = {
+        "WeightsFile": MAIA_WEIGHTS_PATH,
+        "MinibatchSize": BATCH_SIZE,
+        "MaxPrefetch": BATCH_SIZE,
+        # Lc0 memoizes NN evaluations internally; grow that cache well
+        # beyond its 200k default and key it on the position alone
+        # (history length 0) so duplicate puzzle FENs hit regardless of
+        # how they were reached.
+        "NNCacheSize": 2_000_000,
+        "CacheHistoryLength": 0,
+    }
+    if LC0_BACKEND:
+        options["Backend"] = LC0_BACKEND
+    engine.configure(options)
+    return engine
+
 def get_maia_top_move(engine, fen_str):
     """
     Uses an active Maia engine instance to get its top predicted move for the given FEN.
@@ -30,31 +96,151 @@ def get_maia_top_move(engine, fen_str):
         if info and "pv" in info and info["pv"]:
             return info["pv"][0]  # The first move in the principal variation
         else:
-            print("Error: Maia did not return a principal variation (top move).")
+            logger.error("Error: Maia did not return a principal variation (top move).")
             return None
     # Removed EngineTerminatedError and FileNotFoundError from here as engine is managed outside
     except Exception as e:
-        print(f"Error during Maia analysis for FEN {fen_str}: {e}")
+        logger.error("Error during Maia analysis for FEN %s: %s", fen_str, e)
         return None
 
-def process_pgn_file(input_pgn_filepath, easy_output_filepath, hard_output_filepath):
+# Maia's answer depends only on the position, so memoize per FEN. Real
+# puzzle databases repeat positions often and re-running the NN for a
+# repeated FEN is pure waste.
+_maia_cache = {}
+
+# On-disk cache so reruns over overlapping puzzle sets skip the NN
+# entirely. Same normalized-FEN key as the in-memory dict.
+MAIA_CACHE_DB_PATH = "maia_cache.sqlite"
+# Misses are inserted in batches inside one transaction to amortize fsync.
+CACHE_FLUSH_EVERY = 100
+
+class PersistentMaiaCache:
+    """
+    sqlite-backed FEN -> top-move-UCI cache, persisted across runs.
+    WAL mode with synchronous=NORMAL keeps lookups and batched inserts
+    cheap; inserts are buffered and flushed CACHE_FLUSH_EVERY at a time.
+    """
+
+    def __init__(self, path=MAIA_CACHE_DB_PATH):
+        # The evaluation pipeline thread does the lookups/inserts while the
+        # main thread opens and (after joining it) closes the connection,
+        # so the accesses never actually overlap.
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS maia_top_moves (fen TEXT PRIMARY KEY, uci TEXT)")
+        self.conn.commit()
+        self._pending = []
+
+    def get(self, normalized_fen):
+        row = self.conn.execute("SELECT uci FROM maia_top_moves WHERE fen = ?", (normalized_fen,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, normalized_fen, uci):
+        self._pending.append((normalized_fen, uci))
+        if len(self._pending) >= CACHE_FLUSH_EVERY:
+            self.flush()
+
+    def flush(self):
+        if self._pending:
+            with self.conn:
+                self.conn.executemany("INSERT OR REPLACE INTO maia_top_moves (fen, uci) VALUES (?, ?)", self._pending)
+            self._pending = []
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+# Set by process_pgn_file for the duration of a run; evaluate_with_cache
+# falls back to it on in-memory misses.
+_persistent_cache = None
+
+def evaluate_with_cache(fens, evaluator):
+    """
+    Returns Maia's top move for each FEN, consulting the in-memory cache
+    first. evaluator is called once with the list of cache-miss FENs
+    (duplicates within the batch are also collapsed to a single call).
+    """
+    results = [None] * len(fens)
+    pending = {}  # normalized FEN -> result slots waiting on this eval
+    to_evaluate = []
+
+    for i, fen in enumerate(fens):
+        key = normalize_fen(fen)
+        if key in _maia_cache:
+            results[i] = _maia_cache[key]
+            continue
+        if _persistent_cache is not None:
+            uci = _persistent_cache.get(key)
+            if uci is not None:
+                move = chess.Move.from_uci(uci)
+                _maia_cache[key] = move
+                results[i] = move
+                continue
+        if key in pending:
+            pending[key].append(i)
+        else:
+            pending[key] = [i]
+            to_evaluate.append(fen)
+
+    if to_evaluate:
+        for fen, move in zip(to_evaluate, evaluator(to_evaluate)):
+            key = normalize_fen(fen)
+            if move is not None:
+                _maia_cache[key] = move
+                if _persistent_cache is not None:
+                    _persistent_cache.put(key, move.uci())
+            for i in pending[key]:
+                results[i] = move
+    return results
+
+def evaluate_fens(engines, fens):
+    """
+    Evaluates a batch of FENs concurrently across the given engine pool.
+    Returns a list of chess.Move (or None on error) in the same order as fens.
+    """
+    results = [None] * len(fens)
+    # Hand engines out to worker threads via a queue so each analyse() call
+    # has exclusive use of one Lc0 process.
+    free_engines = queue.Queue()
+    for eng in engines:
+        free_engines.put(eng)
+
+    def worker(index, fen):
+        engine = free_engines.get()
+        try:
+            results[index] = get_maia_top_move(engine, fen)
+        finally:
+            free_engines.put(engine)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(engines)) as executor:
+        futures = [executor.submit(worker, i, fen) for i, fen in enumerate(fens)]
+        concurrent.futures.wait(futures)
+    return results
+
+def process_pgn_file(input_pgn_filepath, easy_output_filepath, hard_output_filepath, verbose=False,
+                     puzzles_per_batch=PUZZLES_PER_BATCH):
     """
     Reads puzzles from an input PGN file, classifies them, and writes them
     to separate PGN files based on difficulty, in batches.
+
+    Streams through a three-stage pipeline over bounded queues: a reader
+    thread scans (id, pgn, fen, solution, forced) tuples out of the PGN,
+    an evaluation thread windows them (NN_BATCH_SIZE on the direct-NN
+    path, BATCH_SIZE on the UCI path) and batches the unforced FENs
+    through Maia, and the main thread classifies and writes. Memory stays
+    bounded by the window and queue depths, never the corpus size.
+
+    Per-puzzle progress goes through the logging module at INFO level, so
+    it costs nothing unless logging is configured to show it (--verbose on
+    the command line). With verbose=True, hard-puzzle disagreements are
+    additionally reported in SAN, which costs a board reconstruction per
+    hard puzzle.
     """
-    easy_puzzles_pgn_strings = [] # Still used for summary count
-    hard_puzzles_pgn_strings = [] # Still used for summary count
     error_puzzles_count = 0
     processed_puzzles_count = 0
-    engine = None
-
-    PUZZLES_PER_BATCH = 25
-    easy_batch_num = 0
-    hard_batch_num = 0
-    easy_puzzles_in_current_batch = 0
-    hard_puzzles_in_current_batch = 0
-    f_easy = None
-    f_hard = None
+    engines = []
+    pgn_data = None
 
     # Derive base names for output batch files from the input filename
     base_name_with_ext = os.path.basename(input_pgn_filepath)
@@ -63,155 +249,240 @@ def process_pgn_file(input_pgn_filepath, easy_output_filepath, hard_output_filep
     easy_base_name = f"{base_name_without_ext}_easy"
     hard_base_name = f"{base_name_without_ext}_hard"
 
+    easy_writer = BatchPgnWriter(easy_base_name, puzzles_per_batch)
+    hard_writer = BatchPgnWriter(hard_base_name, puzzles_per_batch)
+
     print(f"Starting puzzle difficulty classification for file: {input_pgn_filepath}")
-    print(f"Puzzles will be written in batches of {PUZZLES_PER_BATCH}.")
+    print(f"Puzzles will be written in batches of {puzzles_per_batch}.")
     print(f"Easy puzzle batches will use base name: {easy_base_name}_batch_N.pgn")
     print(f"Hard puzzle batches will use base name: {hard_base_name}_batch_N.pgn")
 
+    # Prefer running the Maia network directly (batched, no UCI round-trip)
+    # when the ONNX model and onnxruntime are available.
+    use_direct_nn = maia_net.is_available()
+
+    global _persistent_cache
+    try:
+        _persistent_cache = PersistentMaiaCache()
+    except sqlite3.Error as e:
+        print(f"Warning: could not open persistent cache at {MAIA_CACHE_DB_PATH}: {e}. Continuing without it.")
+        _persistent_cache = None
+
     try:
-        # Initialize Maia engine once
+        if use_direct_nn:
+            print(f"Using direct NN inference via {maia_net.MAIA_ONNX_PATH} (no engine processes).")
+        else:
+            # Initialize the Maia engine pool once
+            try:
+                n_workers = num_engine_workers()
+                engines = [start_maia_engine() for _ in range(n_workers)]
+                print(f"Maia engine pool initialized successfully ({n_workers} worker(s)).")
+            except chess.engine.EngineTerminatedError:
+                print(f"Error: Maia engine terminated unexpectedly during initialization. Check executable path: '{LC0_EXECUTABLE_PATH}' and that it's runnable.")
+                return
+            except FileNotFoundError:
+                print(f"Error: Maia executable not found at '{LC0_EXECUTABLE_PATH}' or weights not found at '{MAIA_WEIGHTS_PATH}'. Please check paths.")
+                return
+            except Exception as e:
+                print(f"Error initializing Maia engine: {e}")
+                print("This might be due to incorrect paths, Maia engine issues, or missing/corrupt weights file.")
+                return
+
+        # PGN is effectively ASCII, so work on raw bytes and keep each
+        # game's source slice for verbatim output. The file is mapped
+        # read-only rather than read into a heap copy: the byte-regex
+        # scanners and iter_game_slices work on the mapping directly, the
+        # kernel pages the corpus in on demand, and only tiny substrings
+        # (headers, FENs, move tokens) are ever decoded.
+        fd = os.open(input_pgn_filepath, os.O_RDONLY)
         try:
-            engine = chess.engine.SimpleEngine.popen_uci(LC0_EXECUTABLE_PATH)
-            engine.configure({"WeightsFile": MAIA_WEIGHTS_PATH})
-            print("Maia engine initialized successfully.")
-        except chess.engine.EngineTerminatedError:
-            print(f"Error: Maia engine terminated unexpectedly during initialization. Check executable path: '{LC0_EXECUTABLE_PATH}' and that it's runnable.")
-            return
-        except FileNotFoundError:
-            print(f"Error: Maia executable not found at '{LC0_EXECUTABLE_PATH}' or weights not found at '{MAIA_WEIGHTS_PATH}'. Please check paths.")
-            return
-        except Exception as e:
-            print(f"Error initializing Maia engine: {e}")
-            print("This might be due to incorrect paths, Maia engine issues, or missing/corrupt weights file.")
-            return
-
-        with open(input_pgn_filepath, 'r', encoding='utf-8') as pgn_file: # Add encoding='utf-8'
-            while True:
-                game = chess.pgn.read_game(pgn_file)
-                if game is None:
-                    break  # End of file
-
-                processed_puzzles_count += 1
-                current_puzzle_id_str = f"puzzle #{processed_puzzles_count} (Event: {game.headers.get('Event', 'N/A')})"
-                print(f"\nProcessing {current_puzzle_id_str}...")
-
-                exporter = chess.pgn.StringExporter(headers=True, variations=True, comments=True)
-                current_pgn_string = game.accept(exporter)
-
-                fen = game.headers.get("FEN")
-                setup = game.headers.get("SetUp")
-
-                if setup == "1" and not fen:
-                    print(f"Error: {current_puzzle_id_str} has SetUp='1' but no FEN tag. Skipping.")
-                    error_puzzles_count += 1
-                    continue
-                if not fen:
-                    print(f"Error: {current_puzzle_id_str} FEN tag not found. Cannot determine position. Skipping.")
-                    error_puzzles_count += 1
-                    continue
-
-                mainline_moves = list(game.mainline_moves())
-                if not mainline_moves:
-                    print(f"Error: {current_puzzle_id_str} no solution move found. Skipping.")
-                    print(f"  Headers: {game.headers}")
-                    if game.errors:
-                        print(f"  Parser errors: {game.errors}")
-                    error_puzzles_count += 1
-                    continue
-                
-                solution_move_object = mainline_moves[0]
-                
-                maia_top_move = get_maia_top_move(engine, fen) # Pass engine instance
-
-                if not maia_top_move:
-                    print(f"  Could not get Maia's top move for {current_puzzle_id_str}. Skipping classification.")
-                    error_puzzles_count += 1
-                    continue
-
-                if solution_move_object == maia_top_move:
-                    print(f"  Classification for {current_puzzle_id_str}: Easy")
-                    easy_puzzles_pgn_strings.append(current_pgn_string)
-                    if f_easy is None or easy_puzzles_in_current_batch >= PUZZLES_PER_BATCH:
-                        if f_easy:
-                            f_easy.close()
-                            print(f"Closed easy batch file: {f_easy.name}")
-                        easy_batch_num += 1
-                        current_easy_filename = f"{easy_base_name}_batch_{easy_batch_num}.pgn"
-                        try:
-                            f_easy = open(current_easy_filename, 'w', encoding='utf-8')
-                            print(f"Opened new easy batch file: {current_easy_filename}")
-                        except IOError as e:
-                            print(f"Error opening easy batch file {current_easy_filename}: {e}")
-                            f_easy = None # Prevent further writes if open failed
-                        easy_puzzles_in_current_batch = 0
-                    
-                    if f_easy:
-                        try:
-                            f_easy.write(current_pgn_string + "\n\n")
-                            easy_puzzles_in_current_batch += 1
-                        except IOError as e:
-                            print(f"Error writing to easy batch file {f_easy.name}: {e}")
-                else:
+            pgn_data = mmap.mmap(fd, 0, prot=mmap.PROT_READ)
+        except ValueError:
+            pgn_data = b""  # Empty file cannot be mapped; nothing to scan.
+        finally:
+            os.close(fd)
+        if isinstance(pgn_data, mmap.mmap):
+            try:
+                # We scan front to back exactly once; let readahead know.
+                pgn_data.madvise(mmap.MADV_SEQUENTIAL)
+            except (AttributeError, OSError):
+                pass
+
+        if use_direct_nn:
+            evaluator = maia_net.maia_top_moves_batch
+            # Accumulate a full NN batch per dispatch so each session.run()
+            # really sees NN_BATCH_SIZE positions; with the UCI window the
+            # ONNX chunking loop would never fill a forward pass.
+            window_size = maia_net.NN_BATCH_SIZE
+        else:
+            evaluator = lambda misses: evaluate_fens(engines, misses)
+            window_size = BATCH_SIZE
+
+        # Three-stage pipeline over two bounded queues: a reader thread
+        # scans puzzles out of the PGN, an evaluation thread batches them
+        # through Maia, and the main thread classifies and writes. The
+        # stages overlap, so PGN parsing and file output hide behind
+        # engine/NN latency instead of adding to it.
+        stats = {'processed': 0, 'errors': 0}
+        puzzle_queue = queue.Queue(maxsize=QUEUE_DEPTH)
+        result_queue = queue.Queue(maxsize=QUEUE_DEPTH)
+        # Exceptions from the worker threads, re-raised on the main thread
+        # after the pipeline drains; a daemon thread dying silently would
+        # otherwise look like a clean (but truncated) run.
+        stage_errors = []
+
+        def reader_stage():
+            try:
+                for puzzle in iter_puzzles(pgn_data, stats):
+                    puzzle_queue.put(puzzle)
+            except Exception as e:
+                stage_errors.append(e)
+            finally:
+                puzzle_queue.put(None)  # Sentinel: no more puzzles.
+
+        def evaluation_stage():
+            finished = False
+            try:
+                window = []
+                while not finished:
+                    item = puzzle_queue.get()
+                    if item is None:
+                        finished = True
+                    else:
+                        window.append(item)
+                        if len(window) < window_size:
+                            continue
+                    if window:
+                        # Forced positions (single legal move) already carry
+                        # their answer; only the rest go to Maia. Those are
+                        # evaluated in FEN-sorted order so duplicate and
+                        # near-duplicate positions hit the caches back to
+                        # back; results are re-ordered so output stays in
+                        # input order.
+                        moves = [puzzle[4] for puzzle in window]
+                        order = [i for i in range(len(window)) if moves[i] is None]
+                        order.sort(key=lambda i: window[i][2])
+                        moves_sorted = evaluate_with_cache([window[i][2] for i in order], evaluator)
+                        for i, move in zip(order, moves_sorted):
+                            moves[i] = move
+                        for puzzle, move in zip(window, moves):
+                            result_queue.put((puzzle, move))
+                        window = []
+            except Exception as e:
+                stage_errors.append(e)
+                # The reader may be blocked in put() on a full queue; keep
+                # consuming up to its sentinel (unless it already arrived)
+                # so its join() cannot hang. The unprocessed puzzles are
+                # discarded - the run is failing anyway.
+                if not finished:
+                    while puzzle_queue.get() is not None:
+                        pass
+            finally:
+                result_queue.put(None)  # Sentinel: no more results.
+
+        reader_thread = threading.Thread(target=reader_stage, name="pgn-reader", daemon=True)
+        evaluation_thread = threading.Thread(target=evaluation_stage, name="maia-eval", daemon=True)
+        reader_thread.start()
+        evaluation_thread.start()
+
+        while True:
+            item = result_queue.get()
+            if item is None:
+                break
+            (current_puzzle_id_str, current_pgn_bytes, fen, solution_move_object, _forced), maia_top_move = item
+            logger.info("\nProcessing %s...", current_puzzle_id_str)
+
+            if not maia_top_move:
+                logger.error("  Could not get Maia's top move for %s. Skipping classification.", current_puzzle_id_str)
+                error_puzzles_count += 1
+                continue
+
+            # Compare as UCI strings: the two moves come from different code
+            # paths (PGN parser vs engine/NN output) and string equality
+            # sidesteps any representation quirks around promotions.
+            solution_uci = solution_move_object.uci()
+            maia_uci = maia_top_move.uci()
+
+            if solution_uci == maia_uci:
+                logger.info("  Classification for %s: Easy", current_puzzle_id_str)
+                easy_writer.write(current_pgn_bytes)
+            else:
+                if verbose:
+                    # SAN costs a fresh chess.Board(fen) parse per hard
+                    # puzzle, so it is opt-in; the default path reports the
+                    # disagreement in UCI straight off the Move objects.
                     board_for_san = chess.Board(fen)
-                    solution_san = board_for_san.san(solution_move_object)
-                    maia_san = board_for_san.san(maia_top_move)
-                    print(f"  Classification for {current_puzzle_id_str}: Hard (Solution: {solution_san}, Maia's top: {maia_san})")
-                    hard_puzzles_pgn_strings.append(current_pgn_string)
-                    if f_hard is None or hard_puzzles_in_current_batch >= PUZZLES_PER_BATCH:
-                        if f_hard:
-                            f_hard.close()
-                            print(f"Closed hard batch file: {f_hard.name}")
-                        hard_batch_num += 1
-                        current_hard_filename = f"{hard_base_name}_batch_{hard_batch_num}.pgn"
-                        try:
-                            f_hard = open(current_hard_filename, 'w', encoding='utf-8')
-                            print(f"Opened new hard batch file: {current_hard_filename}")
-                        except IOError as e:
-                            print(f"Error opening hard batch file {current_hard_filename}: {e}")
-                            f_hard = None # Prevent further writes if open failed
-                        hard_puzzles_in_current_batch = 0
-                    
-                    if f_hard:
-                        try:
-                            f_hard.write(current_pgn_string + "\n\n")
-                            hard_puzzles_in_current_batch += 1
-                        except IOError as e:
-                            print(f"Error writing to hard batch file {f_hard.name}: {e}")
+                    logger.info("  Classification for %s: Hard (Solution: %s, Maia's top: %s)",
+                                current_puzzle_id_str, board_for_san.san(solution_move_object),
+                                board_for_san.san(maia_top_move))
+                else:
+                    logger.info("  Classification for %s: Hard (Solution: %s, Maia's top: %s)",
+                                current_puzzle_id_str, solution_uci, maia_uci)
+                hard_writer.write(current_pgn_bytes)
+
+        reader_thread.join()
+        evaluation_thread.join()
+        # Fold the reader's tallies in before any re-raise so the failure
+        # summary still reflects what was actually read and skipped.
+        processed_puzzles_count = stats['processed']
+        error_puzzles_count += stats['errors']
+        if stage_errors:
+            # Surface the first worker-thread failure where the caller can
+            # see it instead of reporting a quietly truncated run.
+            raise stage_errors[0]
 
     except FileNotFoundError:
         print(f"Error: Input PGN file not found at '{input_pgn_filepath}'")
-        return 
+        return
     except Exception as e:
         print(f"An unexpected error occurred while processing the PGN file: {e}")
     finally:
-        if engine:
+        for engine in engines:
             engine.quit()
-            print("Maia engine quit.")
-        if f_easy:
-            f_easy.close()
-            print(f"Closed final easy batch file: {f_easy.name}")
-        if f_hard:
-            f_hard.close()
-            print(f"Closed final hard batch file: {f_hard.name}")
+        if engines:
+            print("Maia engine pool quit.")
+        easy_writer.close()
+        hard_writer.close()
+        # Safe to unmap only after the reader thread is done iterating.
+        if isinstance(pgn_data, mmap.mmap):
+            pgn_data.close()
+        if _persistent_cache is not None:
+            _persistent_cache.close()
+            _persistent_cache = None
 
     # Summary of processing
     print(f"\nSummary: Processed {processed_puzzles_count} puzzles.")
-    print(f"  Total Easy puzzles: {len(easy_puzzles_pgn_strings)}")
-    if easy_batch_num > 0:
-        print(f"  Easy puzzles written to {easy_batch_num} batch file(s) (base: {easy_base_name}_batch_N.pgn)")
-    print(f"  Total Hard puzzles: {len(hard_puzzles_pgn_strings)}")
-    if hard_batch_num > 0:
-        print(f"  Hard puzzles written to {hard_batch_num} batch file(s) (base: {hard_base_name}_batch_N.pgn)")
+    print(f"  Total Easy puzzles: {easy_writer.total_written}")
+    if easy_writer.batch_num > 0:
+        print(f"  Easy puzzles written to {easy_writer.batch_num} batch file(s) (base: {easy_base_name}_batch_N.pgn)")
+    print(f"  Total Hard puzzles: {hard_writer.total_written}")
+    if hard_writer.batch_num > 0:
+        print(f"  Hard puzzles written to {hard_writer.batch_num} batch file(s) (base: {hard_base_name}_batch_N.pgn)")
     if error_puzzles_count > 0:
         print(f"  Puzzles skipped due to errors: {error_puzzles_count}")
 
 
 if __name__ == "__main__":
-    input_pgn_file_to_process = None
+    parser = argparse.ArgumentParser(
+        description="Classify chess puzzles as easy/hard by whether Maia's top move matches the solution.")
+    parser.add_argument("input_pgn", nargs="?", default=None,
+                        help="input PGN file of puzzles (omit to create and process a sample file)")
+    parser.add_argument("--verbose", action="store_true",
+                        help="show per-puzzle progress lines and report hard-puzzle disagreements in SAN")
+    parser.add_argument("--batch-size", type=int, default=PUZZLES_PER_BATCH,
+                        help=f"puzzles per output batch file (default: {PUZZLES_PER_BATCH})")
+    args = parser.parse_args()
+
+    # Per-puzzle progress lines are emitted lazily via logging; by default
+    # only warnings/errors reach the terminal, so the hot loop never pays
+    # for string formatting or console I/O. --verbose opts back in.
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format="%(message)s")
+
     create_sample_file = False
 
-    if len(sys.argv) > 1:
-        input_pgn_file_to_process = sys.argv[1]
+    if args.input_pgn:
+        input_pgn_file_to_process = args.input_pgn
         print(f"Processing user-provided PGN file: {input_pgn_file_to_process}")
     else:
         input_pgn_file_to_process = "sample_puzzles_to_classify.pgn"
@@ -309,7 +580,8 @@ if __name__ == "__main__":
             print(f"Error writing sample PGN file: {e}")
             exit()
 
-    process_pgn_file(input_pgn_file_to_process, easy_puzzles_file, hard_puzzles_file)
+    process_pgn_file(input_pgn_file_to_process, easy_puzzles_file, hard_puzzles_file,
+                     verbose=args.verbose, puzzles_per_batch=args.batch_size)
 
     if create_sample_file:
         print(f"\nTo clean up test files generated by this run, you can delete: {input_pgn_file_to_process}, and batch files starting with '{easy_puzzles_file.rsplit('.',1)[0]}_batch_' and '{hard_puzzles_file.rsplit('.',1)[0]}_batch_'.")
@@ -0,0 +1,214 @@
+"""
+Direct batched inference against the Maia network, bypassing Lc0/UCI.
+
+With nodes=1 Maia is a single policy-head forward pass, so the whole
+UCI round-trip (engine process, stdout parsing, one position per call)
+is overhead. This module runs the network itself through ONNX Runtime
+on batches of positions instead.
+
+To produce the ONNX model from the bundled weights, run once:
+
+    lc0 leela2onnx --input=maia-1100.pb --output=maia-1100.onnx
+
+If onnxruntime (or the .onnx file) is not available, is_available()
+returns False and the caller falls back to the UCI engine path.
+"""
+
+import logging
+import os
+
+import chess
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None
+
+logger = logging.getLogger(__name__)
+
+# IMPORTANT: must correspond to the same weights as MAIA_WEIGHTS_PATH
+# in classify_puzzles.py (see leela2onnx command above).
+MAIA_ONNX_PATH = "maia-1100.onnx"
+
+# Positions per forward pass. The Maia net is tiny, so large batches
+# amortize kernel-launch and host<->device transfer almost completely.
+NN_BATCH_SIZE = 256
+
+def _build_policy_index():
+    """
+    Builds Lc0's fixed 1858-entry policy vocabulary: for every square, all
+    queen-ray and knight destinations (in ascending square order), followed
+    by the rank-7 underpromotion moves suffixed q/r/b. Promotion to knight
+    shares the index of the plain pawn move. Moves are always expressed
+    from the side-to-move's perspective (mirror squares for Black).
+    """
+    index = []
+    for square in range(64):
+        board = chess.BaseBoard.empty()
+        board.set_piece_at(square, chess.Piece(chess.QUEEN, chess.WHITE))
+        queen_targets = board.attacks_mask(square)
+        board.set_piece_at(square, chess.Piece(chess.KNIGHT, chess.WHITE))
+        knight_targets = board.attacks_mask(square)
+        for target in chess.SquareSet(queen_targets | knight_targets):
+            index.append(chess.square_name(square) + chess.square_name(target))
+    for file in range(8):
+        for file_delta in (-1, 0, 1):
+            target_file = file + file_delta
+            if 0 <= target_file < 8:
+                from_name = chess.square_name(chess.square(file, 6))
+                to_name = chess.square_name(chess.square(target_file, 7))
+                for promo in "qrb":
+                    index.append(from_name + to_name + promo)
+    assert len(index) == 1858
+    return index
+
+POLICY_INDEX = _build_policy_index()
+MOVE_TO_POLICY_IDX = {uci: i for i, uci in enumerate(POLICY_INDEX)}
+
+_session = None  # Lazily created ort.InferenceSession
+_policy_output_name = None
+# Reused (NN_BATCH_SIZE, 112, 8, 8) input buffer; see boards_to_planes.
+_planes_buffer = None
+
+def is_available():
+    """Returns True if the direct-NN fast path can be used."""
+    return np is not None and ort is not None and os.path.exists(MAIA_ONNX_PATH)
+
+def _get_session():
+    global _session, _policy_output_name
+    if _session is None:
+        providers = ["CUDAExecutionProvider", "CPUExecutionProvider"]
+        _session = ort.InferenceSession(MAIA_ONNX_PATH, providers=providers)
+        # leela2onnx output names vary between lc0 versions; the policy
+        # head is the only 1858-wide output.
+        for output in _session.get_outputs():
+            if output.shape and output.shape[-1] == 1858:
+                _policy_output_name = output.name
+                break
+        if _policy_output_name is None:
+            raise RuntimeError(f"No 1858-wide policy output found in {MAIA_ONNX_PATH}")
+    return _session
+
+def boards_to_planes(boards):
+    """
+    Encodes a batch of boards as Lc0's (B, 112, 8, 8) input. Puzzle
+    positions have no move history, so the 7 older history slots (planes
+    13..103) stay zero. Plane layout: 12 piece planes (ours PNBRQK then
+    theirs) + repetition, castling rights (104-107), side to move (108),
+    rule-50 counter (109), zeros (110), all-ones (111). Black positions
+    are mirrored vertically so the net always sees the side to move
+    playing "up" the board.
+
+    The rule-50 plane is deliberately left at zero: the caches key
+    answers on the position alone (normalize_fen drops the counters, and
+    the UCI path sets CacheHistoryLength=0), so the encoding must not
+    depend on the halfmove clock either.
+
+    The piece planes come straight from the 12 piece bitboards: packed
+    into a (B, 12) uint64 array and exploded to (B, 12, 8, 8) with one
+    unpackbits call, instead of walking 64 squares per board in Python.
+
+    The batch is written into one module-level buffer that is allocated
+    and zeroed once: 101 of the 112 planes (history, repetition, rule-50,
+    the zero/one constants) are identical for every history-less puzzle
+    position, so each call only rewrites the 12 piece planes and the 5
+    variable aux planes instead of clearing ~3.5 KB per position. The
+    returned array is a view into that buffer, valid until the next call.
+    """
+    global _planes_buffer
+    batch_size = len(boards)
+    if _planes_buffer is None or len(_planes_buffer) < batch_size:
+        _planes_buffer = np.zeros((max(batch_size, NN_BATCH_SIZE), 112, 8, 8), dtype=np.float32)
+        _planes_buffer[:, 111] = 1.0
+    batch = _planes_buffer[:batch_size]
+    # Only the planes written per-position need clearing: pieces (0-11)
+    # are fully overwritten below, so just the conditional aux planes.
+    batch[:, 104:109] = 0.0
+    piece_bb = np.zeros((batch_size, 12), dtype=np.uint64)
+
+    for row, board in enumerate(boards):
+        us = board.turn
+        them = not us
+        for i, piece_type in enumerate(chess.PIECE_TYPES):
+            ours = board.pieces_mask(piece_type, us)
+            theirs = board.pieces_mask(piece_type, them)
+            if us == chess.BLACK:
+                ours = chess.flip_vertical(ours)
+                theirs = chess.flip_vertical(theirs)
+            piece_bb[row, i] = ours
+            piece_bb[row, i + 6] = theirs
+
+        if board.has_queenside_castling_rights(us):
+            batch[row, 104] = 1.0
+        if board.has_kingside_castling_rights(us):
+            batch[row, 105] = 1.0
+        if board.has_queenside_castling_rights(them):
+            batch[row, 106] = 1.0
+        if board.has_kingside_castling_rights(them):
+            batch[row, 107] = 1.0
+        if us == chess.BLACK:
+            batch[row, 108] = 1.0
+
+    # uint64 little-endian: byte k of each bitboard is rank k+1, bit j is
+    # file j, which lines up with the [rank, file] plane layout directly.
+    bits = np.unpackbits(piece_bb.view(np.uint8).reshape(batch_size, 12, 8, 1), axis=-1, bitorder="little")
+    batch[:, :12] = bits.reshape(batch_size, 12, 8, 8)
+    return batch
+
+def board_to_planes(board):
+    """Single-board convenience wrapper around boards_to_planes."""
+    return boards_to_planes([board])[0]
+
+def policy_index_for_move(board, move):
+    """Maps a legal move on the given board to its policy-vector index."""
+    from_square = move.from_square
+    to_square = move.to_square
+    if board.turn == chess.BLACK:
+        from_square = chess.square_mirror(from_square)
+        to_square = chess.square_mirror(to_square)
+    uci = chess.square_name(from_square) + chess.square_name(to_square)
+    # Knight promotion shares the plain move's index; q/r/b are suffixed.
+    if move.promotion and move.promotion != chess.KNIGHT:
+        uci += chess.piece_symbol(move.promotion)
+    return MOVE_TO_POLICY_IDX[uci]
+
+def maia_top_moves_batch(fens):
+    """
+    Returns Maia's top move for each FEN, as a list of chess.Move objects
+    (None for entries that fail to parse). Runs the network once per
+    NN_BATCH_SIZE positions and picks the argmax over each position's
+    legal moves, so the result is always legal.
+    """
+    session = _get_session()
+    input_name = session.get_inputs()[0].name
+    results = [None] * len(fens)
+
+    for chunk_start in range(0, len(fens), NN_BATCH_SIZE):
+        chunk = fens[chunk_start:chunk_start + NN_BATCH_SIZE]
+        boards = []
+        for offset, fen in enumerate(chunk):
+            try:
+                boards.append((chunk_start + offset, chess.Board(fen)))
+            except ValueError as e:
+                logger.error("Error parsing FEN for NN batch: %s: %s", fen, e)
+        if not boards:
+            continue
+
+        batch = boards_to_planes([board for _, board in boards])
+        (policy,) = session.run([_policy_output_name], {input_name: batch})
+
+        for row, (index, board) in enumerate(boards):
+            best_move = None
+            best_score = None
+            for move in board.legal_moves:
+                score = policy[row, policy_index_for_move(board, move)]
+                if best_score is None or score > best_score:
+                    best_score = score
+                    best_move = move
+            results[index] = best_move
+    return results